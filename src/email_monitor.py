@@ -4,173 +4,590 @@ This module provides functionality to monitor a Gmail inbox for new messages.
 """
 
 import asyncio
-import imaplib
+from collections.abc import MutableMapping
 import email
+import functools
 from email.header import decode_header
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from email import policy
+from html.parser import HTMLParser as _StdHTMLParser
 import logging
-import time
-from typing import Callable, Dict, Any, Optional
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from pathlib import Path
+import random
+import re
+import warnings
+from typing import Callable, Dict, Any, Iterator, List, Optional, Set, Tuple
+
+import aioimaplib
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        # selectolax before 0.3.13 only has the Modest backend, removed in 1.0
+        from selectolax.parser import HTMLParser
+    except ImportError:  # selectolax is optional, the standard library parser is used instead
+        HTMLParser = None
+
 logger = logging.getLogger(__name__)
 
+# Gmail drops IDLE sessions after 30 minutes, so re-arm the command before that
+IDLE_TIMEOUT = 29 * 60
+
+# Bounds in seconds of the delay before reconnecting after an error
+BACKOFF_MIN = 5
+BACKOFF_MAX = 300
+
+# The original bytes of the whole message, without setting the \Seen flag.
+# The body text already holds every MIME part, so this only adds the headers
+# we don't use to what parsing the body needs.
+FETCH_ITEMS = '(BODY.PEEK[])'
+
+# Where the last handled UID is kept between runs
+LAST_UID_PATH = Path.home() / '.cache' / 'agent' / 'last_uid'
+
+# Elements starting a new line of text, all others are inline
+_BLOCK_TAGS = frozenset((
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li',
+    'ol', 'p', 'pre', 'section', 'table', 'td', 'th', 'tr', 'ul'
+))
+# Marks a line break between blocks while the text's own whitespace is collapsed
+_BLOCK_BREAK = '\x00'
+_SELECT_UIDVALIDITY = re.compile(rb'\[UIDVALIDITY (\d+)\]')
+_SELECT_UIDNEXT = re.compile(rb'\[UIDNEXT (\d+)\]')
+_FETCH_START = re.compile(rb'^\d+ FETCH \(')
+_FETCH_UID = re.compile(rb'UID (\d+)')
+_FETCH_LITERAL = re.compile(rb'BODY\[\] \{\d+\}$')
+
+def _parse_fetch_response(lines: List[bytes]) -> Dict[str, bytes]:
+    """
+    Split a multi-message UID FETCH response into the raw bytes of each message.
+    
+    Args:
+        lines: Response lines as returned by aioimaplib, literals being bytearrays
+    
+    Returns:
+        Mapping of UID to the raw email bytes
+    """
+    messages = []
+    in_literal = False
+    
+    for line in lines:
+        if isinstance(line, bytearray):
+            # Literal data belongs to the message announced on the previous line
+            if messages and in_literal:
+                messages[-1]['raw'] = bytes(line)
+            in_literal = False
+            continue
+        
+        if _FETCH_START.match(line):
+            messages.append({'uid': None, 'raw': b''})
+        if not messages:
+            continue
+        
+        uid_match = _FETCH_UID.search(line)
+        if uid_match:
+            messages[-1]['uid'] = uid_match.group(1).decode()
+        
+        in_literal = _FETCH_LITERAL.search(line) is not None
+    
+    return {m['uid']: m['raw'] for m in messages if m['uid']}
+
+@functools.lru_cache(maxsize=4096)
+def _decode_header_value(header_value: str) -> str:
+    """
+    Decode email header values that might be encoded.
+    
+    Results are cached, so a header seen again is not decoded twice.
+    
+    Args:
+        header_value: The header value to decode
+    
+    Returns:
+        Decoded header value as string
+    """
+    if not header_value:
+        return ""
+        
+    decoded_parts = []
+    for part, encoding in decode_header(header_value):
+        if isinstance(part, bytes):
+            try:
+                part = part.decode(encoding or 'utf-8', errors='replace')
+            except (LookupError, UnicodeDecodeError):
+                # Unknown or broken charset, most mail is UTF-8 anyway
+                part = part.decode('utf-8', errors='replace')
+        decoded_parts.append(part)
+    
+    return ''.join(decoded_parts)
+
+class _HTMLTextExtractor(_StdHTMLParser):
+    """Collect the text of an HTML document, skipping the head, scripts and styles."""
+    
+    def __init__(self):
+        super().__init__()
+        self._parts: List[str] = []
+        self._skip_depth = 0
+    
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if tag in ('head', 'script', 'style'):
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self._parts.append(_BLOCK_BREAK)
+    
+    def handle_endtag(self, tag: str):
+        if tag in ('head', 'script', 'style'):
+            if self._skip_depth:
+                self._skip_depth -= 1
+        elif tag in _BLOCK_TAGS:
+            self._parts.append(_BLOCK_BREAK)
+    
+    def handle_data(self, data: str):
+        if not self._skip_depth:
+            self._parts.append(data)
+    
+    def text(self) -> str:
+        return ''.join(self._parts)
+
+def _join_blocks(text: str) -> str:
+    """
+    Put each block of text on its own line, with its whitespace collapsed.
+    
+    Args:
+        text: Text whose blocks are separated by _BLOCK_BREAK
+        
+    Returns:
+        The non-empty blocks, one per line
+    """
+    lines = (' '.join(block.split()) for block in text.split(_BLOCK_BREAK))
+    return '\n'.join(line for line in lines if line)
+
+def _html_to_text(html: str) -> str:
+    """
+    Convert an HTML email body to plain text.
+    
+    Uses selectolax when it is installed, the standard library parser otherwise.
+    Inline elements stay within the text around them.
+    
+    Args:
+        html: The HTML to convert
+        
+    Returns:
+        The text content, one block per line
+    """
+    if HTMLParser is not None:
+        tree = HTMLParser(html)
+        tree.strip_tags(['script', 'style'])
+        node = tree.body or tree.root
+        if node is None:
+            return ""
+        for block in node.css(','.join(_BLOCK_TAGS)):
+            block.insert_before(_BLOCK_BREAK)
+            block.insert_after(_BLOCK_BREAK)
+        text = node.text(separator='', strip=False)
+    else:
+        extractor = _HTMLTextExtractor()
+        extractor.feed(html)
+        extractor.close()
+        text = extractor.text()
+    
+    return _join_blocks(text)
+
+def _extract_email_body(email_message: EmailMessage) -> str:
+    """
+    Extract the body text from an email message.
+    
+    Args:
+        email_message: The email message to extract from
+        
+    Returns:
+        The extracted body text
+    """
+    # Plain text is preferred, HTML is used if no plain text is found.
+    # get_body() rejects attachments and non-text parts before looking at their
+    # content, so the chosen part is the only one whose payload gets decoded.
+    part = email_message.get_body(preferencelist=('plain', 'html'))
+    if part is None:
+        return ""
+    
+    # get_content() would read a part without a charset parameter as ASCII,
+    # while such parts are mostly UTF-8
+    payload = part.get_payload(decode=True) or b""
+    try:
+        content = payload.decode(part.get_content_charset() or 'utf-8', errors='replace')
+    except LookupError:
+        content = payload.decode('utf-8', errors='replace')
+    if part.get_content_subtype() == 'html':
+        return _html_to_text(content)
+    return content
+
+class EmailData(MutableMapping):
+    """
+    Details of a received email, as passed to the monitoring callback.
+    
+    The payload behaves like a dict (payload["subject"], payload.copy(), ...)
+    and "body" is always among its keys. The body is only parsed and decoded
+    the first time it is read, so callbacks that only use the headers never
+    pay for MIME parsing. Converting the payload to a dict reads it.
+    
+    Only the original bytes of the email are kept ("raw_email_bytes"); the
+    parsed message is built on demand by raw_email() and never held on to.
+    """
+    
+    def __init__(self, message_id: str, in_reply_to: str, references: str,
+                 subject: str, sender: str, raw_email_bytes: bytes):
+        self._data: Dict[str, Any] = {
+            "message_id": message_id,
+            "in_reply_to": in_reply_to,
+            "references": references,
+            "subject": subject,
+            "sender": sender,
+            "raw_email_bytes": raw_email_bytes
+        }
+        # Whether "body" is a key whose value hasn't been extracted yet
+        self._body_pending = True
+    
+    def raw_email(self) -> EmailMessage:
+        """
+        Parse the original email bytes.
+        
+        Returns:
+            The parsed email message, with all of its headers
+        """
+        return email.message_from_bytes(self._data.get("raw_email_bytes", b""), policy=policy.default)
+    
+    def copy(self) -> "EmailData":
+        """Return a shallow copy, whose body is still only extracted when read."""
+        data = EmailData.__new__(EmailData)
+        data._data = self._data.copy()
+        data._body_pending = self._body_pending
+        return data
+    
+    def __getitem__(self, key: str) -> Any:
+        if key == "body" and self._body_pending:
+            self._data["body"] = _extract_email_body(self.raw_email())
+            self._body_pending = False
+        return self._data[key]
+    
+    def __setitem__(self, key: str, value: Any):
+        if key == "body":
+            self._body_pending = False
+        self._data[key] = value
+    
+    def __delitem__(self, key: str):
+        if key == "body" and self._body_pending:
+            self._body_pending = False
+            return
+        del self._data[key]
+    
+    def __contains__(self, key: object) -> bool:
+        # Without this, the membership test would read the value
+        return key in self._data or (key == "body" and self._body_pending)
+    
+    def __iter__(self) -> Iterator[str]:
+        yield from self._data
+        if self._body_pending:
+            yield "body"
+    
+    def __len__(self) -> int:
+        return len(self._data) + int(self._body_pending)
+    
+    def __repr__(self) -> str:
+        return f"EmailData(subject={self._data.get('subject')!r}, sender={self._data.get('sender')!r})"
+
 class EmailMonitor:
     """
     A class to monitor an email inbox for new messages using IMAP.
     
-    This class connects to a Gmail inbox using IMAP and continuously 
-    checks for new (unread) emails. When a new email is found, it 
+    This class connects to a Gmail inbox using IMAP and waits in IDLE 
+    for new emails. When a new email is found, it 
     extracts the email content and passes it to a callback function.
     """
     
-    def __init__(self, email_address: str, app_password: str):
+    def __init__(self, email_address: str, app_password: str, max_concurrency: int = 4):
         """
         Initialize the EmailMonitor with credentials.
         
         Args:
             email_address: The email address to monitor
             app_password: The application-specific password for Gmail
+            max_concurrency: Maximum number of emails processed by the callback at once
         """
         self.email_address = email_address
         self.app_password = app_password
         self.imap_server = 'imap.gmail.com'
         self.is_running = False
+        self._imap: Optional[aioimaplib.IMAP4_SSL] = None
+        self._sem = asyncio.Semaphore(max_concurrency)
+        # Callbacks still running, referenced so they aren't garbage collected
+        self._tasks: Set[asyncio.Task] = set()
+        # Set by stop_monitoring to cut the reconnect backoff short
+        self._stopped = asyncio.Event()
+        self._backoff = BACKOFF_MIN
+        
+        # Highest UID already handled, persisted so restarts don't replay the inbox
+        self._uid_validity: Optional[int] = None
+        self._last_uid: Optional[int] = None
+        self._load_last_uid()
         
-    async def start_monitoring(self, callback: Callable[[Dict[str, Any]], Any], 
-                                check_interval: int = 30):
+    async def start_monitoring(self, callback: Callable[[EmailData], Any],
+                               check_interval: Optional[int] = None):
         """
         Start monitoring the inbox for new emails.
         
+        A single IMAP session is kept open and the server pushes new-mail
+        notifications through IDLE (RFC 2177), so the inbox is only searched
+        when something has actually arrived. After an error, reconnection is
+        retried with an exponential backoff.
+        
         Args:
             callback: Function to call when a new email is received
-            check_interval: Time in seconds between inbox checks
+            check_interval: Deprecated and ignored, the inbox is no longer polled
         """
+        if check_interval is not None:
+            warnings.warn("check_interval is ignored, new emails are pushed through IDLE",
+                          DeprecationWarning, stacklevel=2)
+        
         self.is_running = True
+        self._stopped.clear()
         logger.info(f"Starting email monitoring for {self.email_address}")
         
         while self.is_running:
             try:
-                # Connect to the IMAP server
-                mail = imaplib.IMAP4_SSL(self.imap_server)
-                mail.login(self.email_address, self.app_password)
-                mail.select('inbox')
-                
-                # Search for unread emails
-                status, messages = mail.search(None, '(UNSEEN)')
+                await self._connect()
                 
-                if status == 'OK' and messages[0]:
-                    logger.info(f"Found {len(messages[0].split())} new email(s)")
+                while self.is_running:
+                    # Pick up anything that arrived since the last handled email.
+                    # New mail is only announced while in IDLE, so search after
+                    # every IDLE cycle whether or not something was announced,
+                    # and again as long as the search finds new emails.
+                    while await self._process_new_emails(callback):
+                        pass
+                    self._backoff = BACKOFF_MIN
                     
-                    for num in messages[0].split():
-                        # Process new email
-                        status, data = mail.fetch(num, '(RFC822)')
-                        email_message = email.message_from_bytes(data[0][1])
-                        
-                        # Extract email details
-                        subject = self._decode_header_value(email_message.get("Subject", ""))
-                        sender = self._decode_header_value(email_message.get("From", ""))
-                        message_id = email_message.get("Message-ID", "")
-                        in_reply_to = email_message.get("In-Reply-To", "")
-                        references = email_message.get("References", "")
-                        
-                        # Extract body
-                        body = self._extract_email_body(email_message)
-                        
-                        # Pass to callback for processing
-                        await callback({
-                            "message_id": message_id,
-                            "in_reply_to": in_reply_to,
-                            "references": references,
-                            "subject": subject,
-                            "sender": sender,
-                            "body": body,
-                            "raw_email": email_message
-                        })
-                
-                # Safely close the connection
-                mail.close()
-                mail.logout()
+                    # Stopped while processing, there is no IDLE to wake up
+                    if not self.is_running:
+                        break
+                    await self._wait_for_new_mail()
             except Exception as e:
                 logger.error(f"Error monitoring emails: {e}")
+            finally:
+                await self._disconnect()
             
-            # Check every interval seconds
-            await asyncio.sleep(check_interval)
+            if self.is_running:
+                # Back off with jitter so an outage doesn't turn into a reconnect storm
+                try:
+                    await asyncio.wait_for(self._stopped.wait(),
+                                           self._backoff + random.uniform(0, self._backoff / 2))
+                except asyncio.TimeoutError:
+                    pass
+                self._backoff = min(self._backoff * 2, BACKOFF_MAX)
+        
+        # Let the callbacks still running finish
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
     
     def stop_monitoring(self):
-        """Stop the email monitoring process."""
+        """
+        Stop the email monitoring process.
+        
+        When called from the event loop, also wakes up a pending IDLE or
+        reconnect backoff, so the monitoring loop can leave IDLE with DONE and
+        log out of the session instead of waiting for the timeout.
+        """
         self.is_running = False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not called from the event loop, IDLE or the backoff ends at its timeout
+            loop = None
+        
+        if loop is not None:
+            self._stopped.set()
+            if self._imap is not None:
+                task = loop.create_task(self._imap.stop_wait_server_push())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
         logger.info("Email monitoring stopped")
     
-    def _decode_header_value(self, header_value: str) -> str:
+    async def _connect(self):
+        """Open the IMAP session, log in and select the inbox."""
+        self._imap = aioimaplib.IMAP4_SSL(host=self.imap_server)
+        await self._imap.wait_hello_from_server()
+        
+        response = await self._imap.login(self.email_address, self.app_password)
+        if response.result != 'OK':
+            raise ConnectionError(f"IMAP login failed: {response.lines}")
+        
+        response = await self._imap.select('INBOX')
+        await self._sync_last_uid(response.lines)
+    
+    async def _sync_last_uid(self, select_lines: List[bytes]):
         """
-        Decode email header values that might be encoded.
+        Initialize the UID tracking from the SELECT response.
+        
+        Without a stored UID, or if the mailbox UIDs were reset (UIDVALIDITY
+        changed), only emails arriving from now on are processed.
         
         Args:
-            header_value: The header value to decode
+            select_lines: Untagged lines of the SELECT response
+        """
+        uid_validity = uid_next = None
+        for line in select_lines:
+            match = _SELECT_UIDVALIDITY.search(line)
+            if match:
+                uid_validity = int(match.group(1))
+            match = _SELECT_UIDNEXT.search(line)
+            if match:
+                uid_next = int(match.group(1))
         
-        Returns:
-            Decoded header value as string
+        if uid_next is None:
+            raise ConnectionError(f"No UIDNEXT in SELECT response: {select_lines}")
+        
+        if self._last_uid is None or uid_validity != self._uid_validity:
+            self._uid_validity = uid_validity
+            self._last_uid = uid_next - 1
+            await self._save_last_uid()
+    
+    def _load_last_uid(self):
+        """Load the last handled UID stored by a previous run, if any."""
+        try:
+            uid_validity, last_uid = LAST_UID_PATH.read_text().split()
+            self._uid_validity, self._last_uid = int(uid_validity), int(last_uid)
+        except (OSError, ValueError):
+            pass
+    
+    async def _save_last_uid(self):
+        """Store the last handled UID for the next run, off the event loop."""
+        def write():
+            LAST_UID_PATH.parent.mkdir(parents=True, exist_ok=True)
+            LAST_UID_PATH.write_text(f"{self._uid_validity} {self._last_uid}")
+        
+        try:
+            await asyncio.to_thread(write)
+        except OSError as e:
+            logger.warning(f"Error saving last email UID: {e}")
+    
+    async def _disconnect(self):
+        """Log out of the IMAP session if one is open."""
+        if self._imap is None:
+            return
+        
+        try:
+            await self._imap.logout()
+        except Exception as e:
+            logger.warning(f"Error closing IMAP connection: {e}")
+        finally:
+            self._imap = None
+    
+    async def _wait_for_new_mail(self):
         """
-        if not header_value:
-            return ""
+        Wait in IDLE until the server announces new messages.
+        
+        The IDLE command is ended after IDLE_TIMEOUT seconds at the latest,
+        so the caller simply searches the inbox and re-arms it.
+        """
+        idle = await self._imap.idle_start(timeout=IDLE_TIMEOUT)
+        
+        while self._imap.has_pending_idle():
+            # Wait longer than the IDLE timeout, so that a regular re-arm
+            # doesn't surface as a timeout error and force a reconnect
+            msg = await self._imap.wait_server_push(timeout=IDLE_TIMEOUT + 60)
+            if msg == aioimaplib.STOP_WAIT_SERVER_PUSH:
+                break
+            if any(b'EXISTS' in line or b'RECENT' in line for line in msg):
+                break
+        
+        if self._imap.has_pending_idle():
+            self._imap.idle_done()
+        await asyncio.wait_for(idle, 5)
+    
+    async def _process_new_emails(self, callback: Callable[[EmailData], Any]) -> bool:
+        """
+        Fetch the emails newer than the last handled UID and pass each one to the callback.
+        
+        Callbacks run concurrently in the background, at most max_concurrency
+        at a time, so IDLE is re-armed without waiting for them.
+        
+        Args:
+            callback: Function to call for each new email
             
-        decoded_parts = []
-        for part, encoding in decode_header(header_value):
-            if isinstance(part, bytes):
-                if encoding:
-                    decoded_parts.append(part.decode(encoding))
-                else:
-                    decoded_parts.append(part.decode('utf-8', errors='replace'))
-            else:
-                decoded_parts.append(part)
+        Returns:
+            True if new emails were passed to the callback, False otherwise
+        """
+        # Only search the UIDs we haven't seen, not the whole inbox
+        response = await self._imap.uid('search', f'UID {self._last_uid + 1}:*')
+        if response.result != 'OK' or not response.lines[0]:
+            return False
+        
+        # "n:*" always matches the newest email, even when its UID is below n
+        uids = [uid for uid in response.lines[0].decode().split() if int(uid) > self._last_uid]
+        if not uids:
+            return False
+        
+        logger.info(f"Found {len(uids)} new email(s)")
+        
+        # Fetch all new emails in a single round-trip
+        uid_set = ','.join(uids)
+        response = await self._imap.uid('fetch', uid_set, FETCH_ITEMS)
+        if response.result != 'OK':
+            logger.error(f"Error fetching emails: {response.lines}")
+            return False
+        
+        payloads = {}
+        for uid, raw_email_bytes in _parse_fetch_response(response.lines).items():
+            # A malformed email must not keep the rest of the batch from being handled
+            try:
+                payloads[uid] = self._email_data(raw_email_bytes)
+            except Exception:
+                logger.exception(f"Error reading email {uid}")
+        
+        if not payloads:
+            return False
         
-        return ''.join(str(part) for part in decoded_parts)
+        # Only the emails handed to the callback are marked handled, the others
+        # are left unread. BODY.PEEK leaves the flags untouched, so mark them
+        # read explicitly.
+        await self._imap.uid('store', ','.join(payloads), '+FLAGS', '(\\Seen)')
+        
+        self._last_uid = max(self._last_uid, *map(int, payloads))
+        await self._save_last_uid()
+        
+        async def dispatch(payload: EmailData):
+            async with self._sem:
+                try:
+                    await callback(payload)
+                except Exception:
+                    logger.exception("Error processing email")
+        
+        for payload in payloads.values():
+            # Pass to callback for processing, without waiting for it or the previous emails.
+            task = asyncio.create_task(dispatch(payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        
+        return True
     
-    def _extract_email_body(self, email_message) -> str:
+    @staticmethod
+    def _email_data(raw_email_bytes: bytes) -> EmailData:
         """
-        Extract the body text from an email message.
+        Extract the details of a fetched email.
         
         Args:
-            email_message: The email message to extract from
+            raw_email_bytes: The original bytes of the email
             
         Returns:
-            The extracted body text
+            The email details passed to the callback
         """
-        body = ""
+        headers = BytesHeaderParser().parsebytes(raw_email_bytes, headersonly=True)
         
-        if email_message.is_multipart():
-            # Handle multipart messages
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition", ""))
-                
-                # Skip attachments
-                if "attachment" in content_disposition:
-                    continue
-                
-                if content_type == "text/plain":
-                    # Plain text is preferred
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        charset = part.get_content_charset() or 'utf-8'
-                        body = payload.decode(charset, errors='replace')
-                        break
-                elif content_type == "text/html" and not body:
-                    # Use HTML if no plain text is found
-                    payload = part.get_payload(decode=True)
-                    if payload:
-                        charset = part.get_content_charset() or 'utf-8'
-                        body = payload.decode(charset, errors='replace')
-                        # In a real implementation, you might want to convert HTML to plain text here
-        else:
-            # Handle non-multipart messages
-            payload = email_message.get_payload(decode=True)
-            if payload:
-                charset = email_message.get_content_charset() or 'utf-8'
-                body = payload.decode(charset, errors='replace')
-        
-        return body
\ No newline at end of file
+        return EmailData(
+            message_id=headers.get("Message-ID", ""),
+            in_reply_to=headers.get("In-Reply-To", ""),
+            references=headers.get("References", ""),
+            subject=_decode_header_value(str(headers.get("Subject", ""))),
+            sender=_decode_header_value(str(headers.get("From", ""))),
+            raw_email_bytes=raw_email_bytes
+        )
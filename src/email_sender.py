@@ -3,25 +3,97 @@ Email sending component for the AI Email Browser Agent.
 This module provides functionality to send email responses to users.
 """
 
-import smtplib
+import asyncio
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import logging
 from typing import Optional, List
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import aiosmtplib
+
 logger = logging.getLogger(__name__)
 
+# Email templates, only the variable parts are rendered on each send
+_CLARIFICATION_TEXT = """I need some clarification to better assist you:
+
+{items}
+Please reply to this email with your answers."""
+
+_CLARIFICATION_HTML = """
+        <html>
+        <body>
+            <p>I need some clarification to better assist you:</p>
+            <ol>
+                {items}
+            </ol>
+            <p>Please reply to this email with your answers.</p>
+        </body>
+        </html>
+        """
+
+_COMPLETION_TEXT = """Task completed! Here's a summary of what I did:
+
+{summary}
+
+Actions performed:
+{items}
+Please let me know if you need anything else."""
+
+_COMPLETION_HTML = """
+        <html>
+        <body>
+            <p><strong>Task completed!</strong> Here's a summary of what I did:</p>
+            <p>{summary}</p>
+            
+            <p><strong>Actions performed:</strong></p>
+            <ol>
+                {items}
+            </ol>
+            
+            <p>Please let me know if you need anything else.</p>
+        </body>
+        </html>
+        """
+
+def _numbered_items(items: List[str]) -> str:
+    """Render items as a numbered plain text list, one per line."""
+    return ''.join(f"{i}. {item}\n" for i, item in enumerate(items, 1))
+
+def _html_items(items: List[str]) -> str:
+    """Render items as HTML list elements."""
+    return ''.join(map('<li>{}</li>'.format, items))
+
+# Lowercased prefixes marking a subject that is already a reply
+_RE_PREFIXES = ('re:', 're :', 'aw:')
+
+def _ensure_re(subject: str) -> str:
+    """Prefix the subject with "Re:" unless it already has a reply prefix."""
+    return subject if subject.lstrip().lower().startswith(_RE_PREFIXES) else f"Re: {subject}"
+
+def _ensure_prefix(subject: str, prefix: str) -> str:
+    """Prefix the subject with the given prefix unless it already has it."""
+    return subject if subject.lstrip().lower().startswith(f"{prefix.lower()}:") else f"{prefix}: {subject}"
+
+def _thread_subject(subject: str, in_reply_to: Optional[str], prefix: str) -> str:
+    """
+    Build the subject line for an outgoing email.
+    
+    Args:
+        subject: Original subject line
+        in_reply_to: Message ID of the email being replied to, if any
+        prefix: Prefix to use when the email starts a new thread
+        
+    Returns:
+        The subject prefixed with "Re:" for replies, or with the given prefix otherwise
+    """
+    return _ensure_re(subject) if in_reply_to else _ensure_prefix(subject, prefix)
+
 class EmailSender:
     """
     A class to handle sending emails via SMTP.
     
-    This class connects to Gmail's SMTP server to send emails,
-    supporting plain text and HTML content, as well as email threading.
+    This class keeps a single connection to Gmail's SMTP server open
+    across sends, supporting plain text and HTML content, as well as email threading.
     """
     
     def __init__(self, email_address: str, app_password: str):
@@ -36,6 +108,42 @@ class EmailSender:
         self.app_password = app_password
         self.smtp_server = 'smtp.gmail.com'
         self.smtp_port = 587
+        self._smtp: Optional[aiosmtplib.SMTP] = None
+        self._smtp_lock = asyncio.Lock()
+    
+    async def _get_smtp(self) -> aiosmtplib.SMTP:
+        """
+        Get the persistent SMTP connection, connecting if needed.
+        
+        Returns:
+            A connected and authenticated SMTP client
+        """
+        if self._smtp is not None and self._smtp.is_connected:
+            try:
+                # Make sure the server hasn't dropped the idle connection
+                await self._smtp.noop()
+                return self._smtp
+            except aiosmtplib.SMTPException:
+                self._smtp = None
+        
+        logger.info(f"Connecting to SMTP server {self.smtp_server}")
+        smtp = aiosmtplib.SMTP(hostname=self.smtp_server, port=self.smtp_port, start_tls=False)
+        await smtp.connect()
+        await smtp.starttls()
+        await smtp.login(self.email_address, self.app_password)
+        
+        self._smtp = smtp
+        return smtp
+    
+    async def close(self):
+        """Close the persistent SMTP connection if one is open."""
+        async with self._smtp_lock:
+            if self._smtp is not None and self._smtp.is_connected:
+                try:
+                    await self._smtp.quit()
+                except aiosmtplib.SMTPException as e:
+                    logger.error(f"Error closing SMTP connection: {e}")
+            self._smtp = None
         
     async def send_email(self, 
                     recipient: str, 
@@ -81,15 +189,17 @@ class EmailSender:
             if html_body:
                 message.attach(MIMEText(html_body, 'html'))
             
-            # Connect to server and send
-            logger.info(f"Connecting to SMTP server {self.smtp_server}")
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.email_address, self.app_password)
-            
-            logger.info(f"Sending email to {recipient}")
-            server.send_message(message)
-            server.quit()
+            # Reuse the persistent connection to send
+            async with self._smtp_lock:
+                logger.info(f"Sending email to {recipient}")
+                try:
+                    smtp = await self._get_smtp()
+                    await smtp.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    # The connection was dropped mid-send, reconnect and retry once
+                    self._smtp = None
+                    smtp = await self._get_smtp()
+                    await smtp.send_message(message)
             
             logger.info("Email sent successfully")
             return True
@@ -117,33 +227,11 @@ class EmailSender:
         Returns:
             Boolean indicating if the email was sent successfully
         """
-        # Create body text with the list of questions
-        body = "I need some clarification to better assist you:\n\n"
-        for i, question in enumerate(questions, 1):
-            body += f"{i}. {question}\n"
-        
-        body += "\nPlease reply to this email with your answers."
-        
-        # Create HTML version for better formatting
-        html_body = f"""
-        <html>
-        <body>
-            <p>I need some clarification to better assist you:</p>
-            <ol>
-                {"".join(f"<li>{question}</li>" for question in questions)}
-            </ol>
-            <p>Please reply to this email with your answers.</p>
-        </body>
-        </html>
-        """
+        body = _CLARIFICATION_TEXT.format(items=_numbered_items(questions))
+        html_body = _CLARIFICATION_HTML.format(items=_html_items(questions))
         
         # Prefix subject with "Clarification needed:" if not a reply
-        if not in_reply_to:
-            subject = f"Clarification needed: {subject}"
-        else:
-            # Only add "Re:" if it's not already there
-            if not subject.startswith("Re:"):
-                subject = f"Re: {subject}"
+        subject = _thread_subject(subject, in_reply_to, "Clarification needed")
         
         return await self.send_email(
             recipient=recipient,
@@ -175,39 +263,11 @@ class EmailSender:
         Returns:
             Boolean indicating if the email was sent successfully
         """
-        # Create body text with the task summary and list of actions
-        body = f"Task completed! Here's a summary of what I did:\n\n{task_summary}\n\n"
-        
-        body += "Actions performed:\n"
-        for i, action in enumerate(actions_performed, 1):
-            body += f"{i}. {action}\n"
-        
-        body += "\nPlease let me know if you need anything else."
-        
-        # Create HTML version for better formatting
-        html_body = f"""
-        <html>
-        <body>
-            <p><strong>Task completed!</strong> Here's a summary of what I did:</p>
-            <p>{task_summary}</p>
-            
-            <p><strong>Actions performed:</strong></p>
-            <ol>
-                {"".join(f"<li>{action}</li>" for action in actions_performed)}
-            </ol>
-            
-            <p>Please let me know if you need anything else.</p>
-        </body>
-        </html>
-        """
+        body = _COMPLETION_TEXT.format(summary=task_summary, items=_numbered_items(actions_performed))
+        html_body = _COMPLETION_HTML.format(summary=task_summary, items=_html_items(actions_performed))
         
         # Prefix subject with "Completed:" if not a reply
-        if not in_reply_to:
-            subject = f"Completed: {subject}"
-        else:
-            # Only add "Re:" if it's not already there
-            if not subject.startswith("Re:"):
-                subject = f"Re: {subject}"
+        subject = _thread_subject(subject, in_reply_to, "Completed")
         
         return await self.send_email(
             recipient=recipient,
@@ -0,0 +1,35 @@
+"""
+Shared LLM client for the AI Email Browser Agent.
+This module provides a single OpenAI chat model per API key and model name.
+"""
+
+import functools
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+# Connections kept open to the OpenAI API between requests
+MAX_KEEPALIVE_CONNECTIONS = 32
+
+@functools.lru_cache(maxsize=None)
+def get_shared_chat_openai(api_key: str, model: str) -> ChatOpenAI:
+    """
+    Get the chat model shared by all components using the same credentials.
+    
+    Sharing the instance shares its HTTP connection pool, so consecutive
+    OpenAI requests reuse keep-alive connections instead of opening new ones.
+    
+    Args:
+        api_key: API key for OpenAI
+        model: Name of the OpenAI model to use
+        
+    Returns:
+        The shared ChatOpenAI instance
+    """
+    return ChatOpenAI(
+        api_key=api_key,
+        model=model,
+        http_async_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+        )
+    )
\ No newline at end of file
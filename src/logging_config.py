@@ -0,0 +1,43 @@
+"""
+Logging configuration for the AI Email Browser Agent.
+This module sets up logging once, from the application entry point.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+# Listener writing the queued records, once configure() has been called
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure(level: int = logging.INFO):
+    """
+    Configure the root logger for the application.
+    
+    Records are put on a queue and written by a listener thread, so logging
+    from coroutines never blocks the event loop on I/O. The listener is
+    stopped at exit, which writes out the records still queued. Only the
+    first call has an effect.
+    
+    Args:
+        level: Minimum level of the messages to log
+    """
+    global _listener
+    if _listener is not None:
+        return
+    
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+    
+    # The listener's handler does the actual formatting
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    
+    logging.basicConfig(level=level, handlers=[queue_handler])
@@ -3,20 +3,17 @@ Query understanding engine for the AI Email Browser Agent.
 This module interprets email queries and determines if clarification is needed.
 """
 
+import contextlib
+import json
 import logging
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 
-from langchain_openai import ChatOpenAI
-from langchain.chains import LLMChain
-from langchain.prompts import PromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+from .llm_client import get_shared_chat_openai
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 # Output schemas for the LLM
@@ -34,6 +31,59 @@ class QueryInterpretation(BaseModel):
     clarification_questions: Optional[List[str]] = Field(None, description="Questions to ask for clarification")
     task_details: TaskDetails = Field(description="Extracted details about the task")
 
+# Response used when the query could not be interpreted, built once and shared
+_FALLBACK_INTERPRETATION = QueryInterpretation(
+    task_type="unknown",
+    requires_clarification=True,
+    clarification_questions=["Could you please provide more details about what you'd like me to do?"],
+    task_details=TaskDetails(
+        website="",
+        action_type="unknown"
+    )
+)
+
+# Prompt used to interpret the email content
+PROMPT_TEMPLATE = """
+        You are an AI assistant that specializes in understanding email requests for browser automation tasks.
+        Analyze the following email content carefully and extract all relevant information:
+        
+        EMAIL CONTENT:
+        {email_content}
+        
+        Determine the following:
+        1. What type of browser task is being requested (browsing, searching, form filling, etc.)
+        2. If any clarification is needed before the task can be executed properly
+        3. Specific details about the task (website, action, target, etc.)
+        
+        If the request is ambiguous or lacks critical information, indicate that clarification is needed 
+        and list specific questions to ask the user.
+        
+        {format_instructions}
+        """
+
+_JSON_DECODER = json.JSONDecoder()
+
+def _parse_complete_json(buffer: str) -> Optional[QueryInterpretation]:
+    """
+    Parse the streamed LLM output once it holds a complete JSON object.
+    
+    Args:
+        buffer: The LLM output received so far
+        
+    Returns:
+        The parsed QueryInterpretation, or None if the JSON object is not complete yet
+    """
+    start = buffer.find("{")
+    if start == -1:
+        return None
+    
+    try:
+        data, _ = _JSON_DECODER.raw_decode(buffer, start)
+    except json.JSONDecodeError:
+        return None
+    
+    return QueryInterpretation.model_validate(data)
+
 class QueryUnderstanding:
     """
     A class to understand and interpret email queries using LangChain and LLMs.
@@ -50,12 +100,20 @@ class QueryUnderstanding:
             openai_api_key: API key for OpenAI
             model_name: Name of the OpenAI model to use
         """
-        self.llm = ChatOpenAI(
-            api_key=openai_api_key,
-            model=model_name,
+        self.llm = get_shared_chat_openai(openai_api_key, model_name).bind(
             temperature=0.1  # Keep temperature low for consistent results
         )
         
+        # The parser, prompt and chain only depend on the output schema, so build them once
+        self._parser = PydanticOutputParser(pydantic_object=QueryInterpretation)
+        self._prompt = PromptTemplate(
+            template=PROMPT_TEMPLATE,
+            input_variables=["email_content"],
+            partial_variables={"format_instructions": self._parser.get_format_instructions()}
+        )
+        # The raw text is streamed so the answer can be parsed as soon as the JSON is complete
+        self._chain = self._prompt | self.llm | StrOutputParser()
+        
     async def interpret_query(self, email_content: str) -> QueryInterpretation:
         """
         Interpret an email query to understand the task and required details.
@@ -66,54 +124,28 @@ class QueryUnderstanding:
         Returns:
             QueryInterpretation object with task details and clarification needs
         """
-        # Set up the parser for structured output
-        parser = PydanticOutputParser(pydantic_object=QueryInterpretation)
-        
-        # Create the prompt template
-        prompt_template = """
-        You are an AI assistant that specializes in understanding email requests for browser automation tasks.
-        Analyze the following email content carefully and extract all relevant information:
-        
-        EMAIL CONTENT:
-        {email_content}
-        
-        Determine the following:
-        1. What type of browser task is being requested (browsing, searching, form filling, etc.)
-        2. If any clarification is needed before the task can be executed properly
-        3. Specific details about the task (website, action, target, etc.)
-        
-        If the request is ambiguous or lacks critical information, indicate that clarification is needed 
-        and list specific questions to ask the user.
-        
-        {format_instructions}
-        """
-        
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["email_content"],
-            partial_variables={"format_instructions": parser.get_format_instructions()}
-        )
-        
-        # Create and run the chain
-        chain = LLMChain(llm=self.llm, prompt=prompt)
         try:
             logger.info("Interpreting email query")
-            result = await chain.arun(email_content=email_content)
-            logger.info("Query interpretation complete")
+            buffer = ""
+            interpretation = None
+            # Closing the stream on break releases the connection to the pool
+            async with contextlib.aclosing(self._chain.astream({"email_content": email_content})) as stream:
+                async for chunk in stream:
+                    buffer += chunk
+                    # Only a closing brace can complete the JSON object
+                    if "}" in chunk:
+                        interpretation = _parse_complete_json(buffer)
+                        if interpretation is not None:
+                            break
+            
+            if interpretation is None:
+                # Let the parser handle whatever else the model produced
+                interpretation = self._parser.parse(buffer)
             
-            # Parse the result into our structured format
-            interpretation = parser.parse(result)
+            logger.info("Query interpretation complete")
             return interpretation
             
         except Exception as e:
             logger.error(f"Error interpreting query: {e}")
             # Provide a fallback response if parsing fails
-            return QueryInterpretation(
-                task_type="unknown",
-                requires_clarification=True,
-                clarification_questions=["Could you please provide more details about what you'd like me to do?"],
-                task_details=TaskDetails(
-                    website="",
-                    action_type="unknown"
-                )
-            )
\ No newline at end of file
+            return _FALLBACK_INTERPRETATION
\ No newline at end of file
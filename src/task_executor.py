@@ -8,13 +8,9 @@ import asyncio
 from typing import Dict, Any, List, Optional, Tuple
 
 from browser_use import Agent
-from langchain_openai import ChatOpenAI
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from .llm_client import get_shared_chat_openai
+
 logger = logging.getLogger(__name__)
 
 class TaskExecutor:
@@ -35,6 +31,7 @@ class TaskExecutor:
         """
         self.openai_api_key = openai_api_key
         self.model_name = model_name
+        self.llm = get_shared_chat_openai(openai_api_key, model_name)
         
     async def execute_task(self, task_description: str, additional_context: Optional[Dict[str, Any]] = None) -> Tuple[bool, Dict[str, Any], List[str]]:
         """
@@ -64,7 +61,7 @@ class TaskExecutor:
             # Initialize the browser-use agent
             agent = Agent(
                 task=contextualized_task,
-                llm=ChatOpenAI(api_key=self.openai_api_key, model=self.model_name),
+                llm=self.llm,
                 # Additional configuration can be added here
             )
             
@@ -3,43 +3,184 @@ LangGraph workflow implementation for the AI Email Browser Agent.
 This module defines the state graph for task processing.
 """
 
+import asyncio
+import base64
+from collections.abc import Mapping
+import functools
 import logging
-from typing import Dict, List, Optional, Any, TypedDict, Union
-from pydantic import BaseModel, Field
+import re
+from typing import Annotated, Dict, List, Literal, Optional, Any, Sequence, Tuple, TypedDict, Union
+from pydantic import BaseModel
 
+import jinja2
+import orjson
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import HumanMessage, AIMessage
-from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, START, END
+from langgraph.graph.message import add_messages
+
+from ..email_sender import EmailSender
+from .semantic_cache import SemanticCache
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
+def _concat_actions(left: Sequence[str], right: Sequence[str]) -> Tuple[str, ...]:
+    """Append actions to the log, which may have been given as a list."""
+    return tuple(left) + tuple(right)
+
 # Define the state type for our workflow
-class AgentState(BaseModel):
-    """State for the email agent workflow"""
+class AgentState(TypedDict, total=False):
+    """
+    State for the email agent workflow.
+    
+    email_data and task must be provided when starting the workflow, the other
+    fields are filled in by the nodes. Nodes return only the fields they change;
+    list fields are appended to rather than replaced, messages being merged by ID.
+    """
     # Core state fields
-    email_data: Dict[str, Any] = Field(description="Original email data including message IDs")
-    conversation_history: List[Union[HumanMessage, AIMessage]] = Field(default_factory=list, description="Conversation history")
-    task: str = Field(description="Task description from the email")
+    email_data: Dict[str, Any]  # Original email data including message IDs
+    conversation_history: Annotated[List[Union[HumanMessage, AIMessage]], add_messages]  # Conversation history
+    task: str  # Task description from the email
     
     # Task interpretation state
-    task_details: Optional[Dict[str, Any]] = Field(None, description="Parsed task details")
-    needs_clarification: bool = Field(False, description="Whether clarification is needed")
-    clarification_questions: Optional[List[str]] = Field(None, description="Questions to ask for clarification")
+    task_details: Optional[Dict[str, Any]]  # Parsed task details
+    needs_clarification: bool  # Whether clarification is needed
+    clarification_questions: Optional[List[str]]  # Questions to ask for clarification
     
     # Execution state
-    browser_state: Optional[Dict[str, Any]] = Field(None, description="State of the browser execution")
-    action_log: List[str] = Field(default_factory=list, description="Log of actions performed")
+    browser_state: Optional[Dict[str, Any]]  # State of the browser execution
+    action_log: Annotated[Tuple[str, ...], _concat_actions]  # Log of actions performed
     
     # Task completion state
-    completed: bool = Field(False, description="Whether the task is completed")
-    results: Optional[Dict[str, Any]] = Field(None, description="Results of the task execution")
+    completed: bool  # Whether the task is completed
+    results: Optional[Dict[str, Any]]  # Results of the task execution
     
     # Error handling
-    error: Optional[str] = Field(None, description="Error message if any")
+    error: Optional[str]  # Error message if any
+
+# Completion report, compiled once; the output is plain text so nothing is escaped
+_REPORT_TEMPLATE = jinja2.Environment(autoescape=False, trim_blocks=True, lstrip_blocks=True).from_string(
+    "Task completed! Here's a summary:\n\n"
+    "{{ summary }}\n"
+    "{% if actions %}\n"
+    "\n"
+    "Actions:\n"
+    "{% for action in actions %}\n"
+    "- {{ action }}\n"
+    "{% endfor %}\n"
+    "{% endif %}"
+)
+
+def _json_default(obj: Any) -> Any:
+    """
+    Serialize the values orjson doesn't handle natively, like messages, the
+    email payload (a Mapping) and its raw bytes (base64-encoded).
+    """
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return base64.b64encode(obj).decode("ascii")
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps_state(state: AgentState) -> bytes:
+    """
+    Serialize a workflow state to JSON, e.g. to store it.
+    
+    The whole state is kept, so the email payload's body gets extracted and
+    its raw bytes are included; don't use this just to log a state.
+    
+    Args:
+        state: The workflow state
+        
+    Returns:
+        The UTF-8 encoded JSON document
+    """
+    return orjson.dumps(state, default=_json_default)
+
+# Recurring task templates that are interpreted without the LLM,
+# signature -> (pattern the whole task description must match, task details).
+# Named groups of the pattern fill in the task details the template leaves
+# open; tasks phrased any other way go through the LLM.
+TASK_TEMPLATES: Dict[str, Tuple[re.Pattern, Dict[str, Any]]] = {
+    "summarize_inbox": (
+        re.compile(r"(?:please\s+)?(?:summari[sz]e|give\s+me\s+a\s+summary\s+of)\s+my\s+(?:gmail\s+)?inbox\s*[.!]?",
+                   re.IGNORECASE),
+        {"website": "mail.google.com", "action_type": "summarize", "target": "inbox"}
+    ),
+    "archive": (
+        # The sender is up to four words or an address, without chained requests
+        re.compile(r"(?:please\s+)?archive\s+(?:all\s+)?(?:the\s+)?(?:e-?mails?|messages?)\s+from\s+"
+                   r"(?P<target>(?!(?:and|then)\b)[\w@+-]+(?:\.[\w@+-]+)*(?:\s+(?!(?:and|then)\b)[\w@+-]+(?:\.[\w@+-]+)*){0,3})\s*[.!]?",
+                   re.IGNORECASE),
+        {"website": "mail.google.com", "action_type": "archive"}
+    ),
+}
+
+def _signature(task: str) -> Optional[str]:
+    """
+    Find the template a task description matches.
+    
+    Args:
+        task: The task description
+        
+    Returns:
+        The signature of the matching template, or None
+    """
+    for task_signature, (pattern, _) in TASK_TEMPLATES.items():
+        if pattern.fullmatch(task.strip()):
+            return task_signature
+    return None
+
+def _template_details(task_signature: str, task: str) -> Dict[str, Any]:
+    """
+    Get the task details of a task matching a template.
+    
+    Args:
+        task_signature: Key of TASK_TEMPLATES the task matches
+        task: The task description
+        
+    Returns:
+        A new dict with the template's task details and those captured from the task
+    """
+    pattern, task_details = TASK_TEMPLATES[task_signature]
+    return {**task_details, **pattern.fullmatch(task.strip()).groupdict()}
+
+def _template_analysis(task_signature: str):
+    """
+    Create an analysis node that fills in the task details from a template.
+    
+    Args:
+        task_signature: Key of TASK_TEMPLATES the analyzed tasks match
+        
+    Returns:
+        The node function
+    """
+    async def analyze_task(state: AgentState) -> Dict[str, Any]:
+        logger.debug("Using task template")
+        if state.get("task_details") is not None:
+            return {}
+        return {"task_details": _template_details(task_signature, state["task"])}
+    
+    return analyze_task
+
+def _llm_identity(llm: Optional[BaseChatModel]) -> str:
+    """
+    Identify a chat model by its class and model name.
+    
+    Args:
+        llm: The chat model, if any
+        
+    Returns:
+        The identity of the model, empty without one
+    """
+    if llm is None:
+        return ""
+    model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or ""
+    return f"{type(llm).__name__}:{model}"
 
 class AgentWorkflow:
     """
@@ -47,16 +188,63 @@ class AgentWorkflow:
     
     This class defines a graph-based workflow to handle the entire process from
     understanding an email query to executing the task and reporting the results.
+    
+    Nodes run on the event loop shared by every concurrent workflow, so they
+    must never block it: network calls go through async clients (such as
+    QueryUnderstanding, TaskExecutor and EmailSender), and any unavoidable
+    synchronous call is wrapped in `await asyncio.to_thread(fn, *args)`.
     """
     
-    def __init__(self):
-        """Initialize the workflow with the state graph."""
+    def __init__(self, 
+                 embeddings: Optional[Embeddings] = None,
+                 llm: Optional[BaseChatModel] = None,
+                 email_sender: Optional[EmailSender] = None):
+        """
+        Initialize the workflow with the state graph.
+        
+        The LLM and email sender are created once by the caller and shared by
+        every run, so their connection pools stay warm between nodes and runs.
+        The caller keeps ownership of them and closes them when done, e.g.
+        with EmailSender.close().
+        
+        Args:
+            embeddings: Optional embedding model used to also serve paraphrased
+                tasks from the interpretation cache
+            llm: Chat model shared by the nodes, e.g. from get_shared_chat_openai()
+            email_sender: Email sender shared by the nodes
+        """
+        # Interpretations depend on the model, so it is part of the cache keys
+        self.task_cache = SemanticCache(
+            embed=embeddings.aembed_query if embeddings else None,
+            namespace=_llm_identity(llm)
+        )
+        self.llm = llm
+        self.email_sender = email_sender
+        
+        # The compiled graph is shared by all instances, per-instance resources
+        # reach the nodes through the run configuration
         self.graph = self._build_workflow_graph()
+        self.config = {
+            "configurable": {
+                "task_cache": self.task_cache,
+                "llm": self.llm,
+                "email_sender": self.email_sender
+            }
+        }
     
-    def _build_workflow_graph(self) -> StateGraph:
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _build_workflow_graph(cls, task_signature: Optional[str] = None) -> StateGraph:
         """
         Build the workflow graph.
         
+        The graph is only built and compiled once per class and signature, the
+        nodes don't depend on any instance.
+        
+        Args:
+            task_signature: Key of TASK_TEMPLATES to build a graph specialized for,
+                whose analysis step uses the template instead of the LLM
+        
         Returns:
             StateGraph: The compiled workflow graph
         """
@@ -64,83 +252,98 @@ class AgentWorkflow:
         workflow = StateGraph(AgentState)
         
         # Add all the nodes (processing steps)
-        workflow.add_node("analyze_task", self.analyze_task)
-        workflow.add_node("request_clarification", self.request_clarification)
-        workflow.add_node("execute_task", self.execute_task)
-        workflow.add_node("handle_execution_results", self.handle_execution_results)
-        workflow.add_node("prepare_report", self.prepare_report)
+        if task_signature is None:
+            workflow.add_node("analyze_task", cls.analyze_task)
+        else:
+            workflow.add_node("analyze_task", _template_analysis(task_signature))
+        workflow.add_node("warm_browser", cls.warm_browser)
+        workflow.add_node("request_clarification", cls.request_clarification)
+        workflow.add_node("execute_task", cls.execute_task)
+        workflow.add_node("prepare_report", cls.prepare_report)
         
         # Define the edges (flow between steps)
         # From analyze_task, either request clarification or execute the task
-        workflow.add_conditional_edges(
-            "analyze_task",
-            {
-                True: "request_clarification",
-                False: "execute_task"
-            },
-            self.needs_clarification
-        )
+        workflow.add_conditional_edges("analyze_task", cls.needs_clarification)
         
-        # After clarification, go back to analyze the task again
-        workflow.add_edge("request_clarification", "analyze_task")
+        # After clarification, analyze the task again only if it hasn't been yet
+        workflow.add_conditional_edges("request_clarification", cls.needs_analysis)
         
-        # After execution, handle the results
-        workflow.add_edge("execute_task", "handle_execution_results")
-        
-        # After handling results, either send report (if done) or request clarification
-        workflow.add_conditional_edges(
-            "handle_execution_results",
-            {
-                True: "prepare_report", 
-                False: "request_clarification"
-            },
-            self.is_execution_complete
-        )
+        # After execution, either send report (if done) or request clarification
+        workflow.add_conditional_edges("execute_task", cls.is_execution_complete)
         
         # After preparing report, end the workflow
         workflow.add_edge("prepare_report", END)
         
-        # Set the entry point
-        workflow.set_entry_point("analyze_task")
+        # Start by analyzing the task and warming up the browser in parallel,
+        # the browser is ready by the time the task gets executed
+        workflow.add_edge(START, "analyze_task")
+        workflow.add_edge(START, "warm_browser")
+        workflow.add_edge("warm_browser", END)
         
         return workflow.compile()
     
     # Node implementations
     
-    async def analyze_task(self, state: AgentState) -> AgentState:
+    @staticmethod
+    async def analyze_task(state: AgentState, config: RunnableConfig) -> Dict[str, Any]:
         """
         Analyze the task to determine if clarification is needed.
         
         This is a placeholder for the actual implementation, which would use
-        the QueryUnderstanding class to interpret the task.
+        the QueryUnderstanding class to interpret the task. It runs in parallel
+        with warm_browser, so it only returns the fields it updates.
         
         Args:
             state: The current workflow state
+            config: Run configuration holding the workflow's task cache
             
         Returns:
-            Updated workflow state
+            Updated workflow state fields
         """
-        logger.info("Analyzing task")
+        logger.debug("Analyzing task")
         # In a real implementation, this would be delegated to the QueryUnderstanding class
-        # For now, we'll just check if the needs_clarification flag is already set
         
-        # If task_details is not yet set, we need to interpret the task
-        if state.task_details is None:
-            # This would be where we call query_engine.interpret_query()
+        # A resumed or clarified run may start out with the task already interpreted
+        if state.get("task_details") is not None:
+            return {}
+        
+        # Same or paraphrased tasks reuse a previous interpretation
+        task_cache = config["configurable"]["task_cache"]
+        task_details, embedding = await task_cache.lookup(state["task"])
+        if task_details is None:
+            # This would be where we call query_engine.interpret_query() with the shared
+            # LLM from config["configurable"]["llm"]
             # For now, we'll just set a dummy value
+            # needs_clarification would also be set based on the interpretation results
             task_details = {"interpreted": True}
-            
-            return AgentState(
-                **state.model_dump(),
-                task_details=task_details,
-                # These would be set based on the interpretation results
-                needs_clarification=state.needs_clarification  
-            )
+            # Paraphrases may name another target, so interpretations with task
+            # specific details are only reused for the exact same task
+            semantic = not (task_details.get("target") or task_details.get("additional_context"))
+            await task_cache.update(state["task"], task_details, embedding, semantic=semantic)
+        
+        return {"task_details": task_details}
+    
+    @staticmethod
+    async def warm_browser(state: AgentState) -> Dict[str, Any]:
+        """
+        Warm up the browser session while the task is being analyzed.
         
-        # If we already have task details, just return the current state
-        return state
+        This is a placeholder for the actual implementation, which would start
+        the browser used by the TaskExecutor class so that execute_task doesn't
+        pay for a cold start.
+        
+        Args:
+            state: The current workflow state
+            
+        Returns:
+            Updated workflow state fields
+        """
+        logger.debug("Warming up browser")
+        # For now, just record that the browser is ready
+        return {"browser_state": {"warmed": True}}
     
-    async def request_clarification(self, state: AgentState) -> AgentState:
+    @staticmethod
+    async def request_clarification(state: AgentState) -> Dict[str, Any]:
         """
         Request clarification from the user.
         
@@ -151,90 +354,79 @@ class AgentWorkflow:
             state: The current workflow state
             
         Returns:
-            Updated workflow state
+            Updated workflow state fields
         """
-        logger.info("Requesting clarification")
-        # In a real implementation, this would be delegated to the EmailSender class
-        # which would send an email with the clarification questions
+        logger.debug("Requesting clarification")
+        # In a real implementation, this would be delegated to the shared EmailSender
+        # (config["configurable"]["email_sender"]) which would send an email with the
+        # clarification questions
         
         # For now, just add a message to the conversation history
-        if state.clarification_questions:
+        clarification_questions = state.get("clarification_questions")
+        if clarification_questions:
             question_text = "I need some clarification:\n" + "\n".join(
-                f"- {q}" for q in state.clarification_questions
+                f"- {q}" for q in clarification_questions
             )
             
             # Add the AI message to the conversation history
-            state.conversation_history.append(AIMessage(content=question_text))
-            
             # In a real implementation, this would wait for a response
             # For now, we'll just toggle the flag (would be set when a reply is received)
-            state.needs_clarification = False
+            return {
+                "conversation_history": [AIMessage(content=question_text)],
+                "needs_clarification": False
+            }
             
-        return state
+        return {}
     
-    async def execute_task(self, state: AgentState) -> AgentState:
+    @staticmethod
+    async def execute_task(state: AgentState) -> Dict[str, Any]:
         """
         Execute the browser task.
         
         This is a placeholder for the actual implementation, which would use
-        the TaskExecutor class to execute the browser task.
+        the TaskExecutor class to execute the browser task and analyze its
+        results to determine if further clarification is needed.
         
         Args:
             state: The current workflow state
             
         Returns:
-            Updated workflow state
+            Updated workflow state fields
         """
-        logger.info("Executing task")
+        logger.debug("Executing task")
         # In a real implementation, this would be delegated to the TaskExecutor class
         
         # For now, just set some dummy results
         browser_state = {"executed": True}
-        action_log = ["Opened browser", "Performed action", "Completed task"]
-        
-        return AgentState(
-            **state.model_dump(),
-            browser_state=browser_state,
-            action_log=action_log,
-            # These would be set based on the execution results
-            completed=True
-        )
-    
-    async def handle_execution_results(self, state: AgentState) -> AgentState:
-        """
-        Handle the results of task execution.
-        
-        This is a placeholder for the actual implementation, which would analyze
-        the execution results and determine if further clarification is needed.
-        
-        Args:
-            state: The current workflow state
-            
-        Returns:
-            Updated workflow state
-        """
-        logger.info("Handling execution results")
-        
-        # Check if the task was completed successfully
-        if state.browser_state and state.browser_state.get("executed", False):
+        update = {
+            "browser_state": browser_state,
+            "action_log": ("Opened browser", "Performed action", "Completed task"),
+            # This would be set based on the execution results
+            "completed": True
+        }
+        
+        # Handle the results here rather than in a separate node, which saves
+        # a graph step per run
+        if browser_state.get("executed", False):
             # In a real implementation, we might check for specific conditions
             # that would require further clarification
-            
-            # For now, just set the results
-            state.results = {
+            update["results"] = {
                 "success": True,
                 "summary": "Task completed successfully",
                 "details": "Browser automation task was executed as requested."
             }
         else:
             # If there was an error, we might need clarification
-            state.needs_clarification = True
-            state.clarification_questions = ["Could you provide more details about the task?"]
-            state.error = "Failed to execute the task"
+            update.update({
+                "needs_clarification": True,
+                "clarification_questions": ["Could you provide more details about the task?"],
+                "error": "Failed to execute the task"
+            })
         
-        return state
+        return update
     
-    async def prepare_report(self, state: AgentState) -> AgentState:
+    @staticmethod
+    async def prepare_report(state: AgentState) -> Dict[str, Any]:
         """
         Prepare a report of the completed task.
         
@@ -245,22 +437,26 @@ class AgentWorkflow:
             state: The current workflow state
             
         Returns:
-            Updated workflow state
+            Updated workflow state fields
         """
-        logger.info("Preparing report")
-        # In a real implementation, this would be delegated to the EmailSender class
+        logger.debug("Preparing report")
+        # In a real implementation, this would be delegated to the shared EmailSender
+        # (config["configurable"]["email_sender"])
         
         # For now, just add a message to the conversation history
-        report_text = f"Task completed! Here's a summary:\n\n{state.results.get('summary', '')}"
+        results = state.get("results") or {}
+        report_text = _REPORT_TEMPLATE.render(
+            summary=results.get("summary", ""),
+            actions=state.get("action_log", ())
+        )
         
         # Add the AI message to the conversation history
-        state.conversation_history.append(AIMessage(content=report_text))
-        
-        return state
+        return {"conversation_history": [AIMessage(content=report_text)]}
     
     # Helper functions for conditional routing
     
-    def needs_clarification(self, state: AgentState) -> bool:
+    @staticmethod
+    def needs_clarification(state: AgentState) -> Literal["request_clarification", "execute_task"]:
         """
         Determine if clarification is needed.
         
@@ -268,11 +464,27 @@ class AgentWorkflow:
             state: The current workflow state
             
         Returns:
-            True if clarification is needed, False otherwise
+            The next node: request_clarification if clarification is needed,
+            execute_task otherwise
         """
-        return state.needs_clarification
+        return "request_clarification" if state.get("needs_clarification", False) else "execute_task"
     
-    def is_execution_complete(self, state: AgentState) -> bool:
+    @staticmethod
+    def needs_analysis(state: AgentState) -> Literal["analyze_task", "execute_task"]:
+        """
+        Determine if the task needs to be analyzed after a clarification.
+        
+        Args:
+            state: The current workflow state
+            
+        Returns:
+            The next node: analyze_task if the task hasn't been interpreted yet,
+            execute_task otherwise
+        """
+        return "analyze_task" if state.get("task_details") is None else "execute_task"
+    
+    @staticmethod
+    def is_execution_complete(state: AgentState) -> Literal["prepare_report", "request_clarification"]:
         """
         Determine if the execution is complete.
         
@@ -280,12 +492,31 @@ class AgentWorkflow:
             state: The current workflow state
             
         Returns:
-            True if execution is complete, False otherwise
+            The next node: prepare_report if execution is complete,
+            request_clarification otherwise
         """
-        return state.completed and not state.needs_clarification
+        if state.get("completed", False) and not state.get("needs_clarification", False):
+            return "prepare_report"
+        return "request_clarification"
     
     # Public API
     
+    def _graph_for(self, task: str) -> StateGraph:
+        """
+        Get the graph to run a task with.
+        
+        Args:
+            task: The task description
+            
+        Returns:
+            The graph specialized for the task's template if it matches one,
+            the general graph otherwise
+        """
+        task_signature = _signature(task)
+        if task_signature is None:
+            return self.graph
+        return self._build_workflow_graph(task_signature)
+    
     async def run(self, initial_state: AgentState) -> AgentState:
         """
         Run the workflow with the given initial state.
@@ -299,13 +530,34 @@ class AgentWorkflow:
         logger.info("Starting agent workflow")
         try:
             # Execute the graph with the initial state
-            result = await self.graph.ainvoke(initial_state)
+            graph = self._graph_for(initial_state["task"])
+            result = await graph.ainvoke(initial_state, config=self.config)
             logger.info("Workflow completed successfully")
             return result
         except Exception as e:
-            logger.error(f"Error running workflow: {e}")
-            # Return the initial state with an error
-            return AgentState(
-                **initial_state.model_dump(),
-                error=str(e)
-            )
\ No newline at end of file
+            logger.exception("Error running workflow")
+            # Return a shallow copy of the initial state with the error
+            return {**initial_state, "error": str(e)}
+    
+    async def run_many(self, initial_states: List[AgentState], max_concurrency: int = 16) -> List[AgentState]:
+        """
+        Run the workflow for several initial states concurrently.
+        
+        Args:
+            initial_states: The initial workflow states, e.g. one per incoming email
+            max_concurrency: Maximum number of workflows running at once; tune it
+                to the LLM provider's rate limits
+            
+        Returns:
+            The final workflow states, in the same order as the initial states
+        """
+        logger.info(f"Starting {len(initial_states)} agent workflows")
+        # Each state may run on a different (specialized) graph, so a single
+        # abatch doesn't fit; bound the concurrent runs with a semaphore instead
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def run_one(initial_state: AgentState) -> AgentState:
+            async with semaphore:
+                return await self.run(initial_state)
+        
+        return await asyncio.gather(*(run_one(state) for state in initial_states))
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+Semantic cache for the AI Email Browser Agent workflow.
+This module caches task interpretations so paraphrased requests skip the LLM.
+"""
+
+import copy
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SemanticCache:
+    """
+    A two-tier in-memory cache keyed by task descriptions.
+    
+    Lookups first try an exact match on the hashed task text, then, if an
+    embedding function is configured, the most similar cached task by cosine
+    similarity. Only a miss on both tiers needs a live LLM call.
+    
+    The cached embeddings are rows of a single matrix, so the similarity
+    search is one matrix-vector product and doesn't hold up the event loop.
+    Values are copied in and out, so callers can't alter the cached ones.
+    """
+    
+    def __init__(self, 
+                 embed: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+                 threshold: float = 0.92,
+                 max_entries: int = 1024,
+                 namespace: str = ""):
+        """
+        Initialize the cache.
+        
+        Args:
+            embed: Async function returning the embedding of a text, e.g.
+                OpenAIEmbeddings().aembed_query; without it only exact matches hit
+            threshold: Minimum cosine similarity for a semantic hit
+            max_entries: Number of entries kept, least recently used are evicted
+            namespace: Part of every key, e.g. identifying the model the values
+                were produced with
+        """
+        self.embed = embed
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.namespace = namespace
+        # Hash of the task -> (row of its embedding in the matrix or None, cached value)
+        self._entries: "OrderedDict[str, Tuple[Optional[int], Any]]" = OrderedDict()
+        # Normalized embeddings, allocated for max_entries rows once the size is known
+        self._matrix: Optional[np.ndarray] = None
+        # Hash of the task of each used row of the matrix
+        self._row_keys: List[str] = []
+    
+    def _key(self, task: str) -> str:
+        return hashlib.md5(f"{self.namespace}\0{task}".encode(), usedforsecurity=False).hexdigest()
+    
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        embedding = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+    
+    async def lookup(self, task: str) -> Tuple[Optional[Any], Optional[np.ndarray]]:
+        """
+        Look up the cached value for a task.
+        
+        Args:
+            task: The task description
+            
+        Returns:
+            A tuple of (cached value or None, embedding of the task or None); pass
+            the embedding back to update() on a miss so it isn't computed twice
+        """
+        key = self._key(task)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return copy.deepcopy(self._entries[key][1]), None
+        
+        if self.embed is None:
+            return None, None
+        
+        embedding = self._normalize(await self.embed(task))
+        if not self._row_keys:
+            return None, embedding
+        
+        scores = self._matrix[:len(self._row_keys)] @ embedding
+        best_row = int(np.argmax(scores))
+        best_score = float(scores[best_row])
+        if best_score < self.threshold:
+            return None, embedding
+        
+        logger.info(f"Semantic cache hit (similarity {best_score:.3f})")
+        best_key = self._row_keys[best_row]
+        self._entries.move_to_end(best_key)
+        return copy.deepcopy(self._entries[best_key][1]), embedding
+    
+    async def update(self, task: str, value: Any, embedding: Optional[np.ndarray] = None,
+                     semantic: bool = True):
+        """
+        Store the value for a task.
+        
+        Args:
+            task: The task description
+            value: The value to cache
+            embedding: Normalized task embedding returned by lookup(), if any
+            semantic: Whether similar tasks may be served the value too; pass
+                False for values specific to this exact task
+        """
+        if not semantic:
+            embedding = None
+        elif embedding is None and self.embed is not None:
+            embedding = self._normalize(await self.embed(task))
+        
+        key = self._key(task)
+        row = self._entries[key][0] if key in self._entries else None
+        if embedding is None and row is not None:
+            self._remove_row(row)
+            row = None
+        elif embedding is not None:
+            if self._matrix is None:
+                self._matrix = np.empty((self.max_entries + 1, embedding.shape[0]), dtype=np.float32)
+            if row is None:
+                row = len(self._row_keys)
+                self._row_keys.append(key)
+            self._matrix[row] = embedding
+        
+        self._entries[key] = (row, copy.deepcopy(value))
+        self._entries.move_to_end(key)
+        
+        if len(self._entries) > self.max_entries:
+            _, (evicted_row, _) = self._entries.popitem(last=False)
+            if evicted_row is not None:
+                self._remove_row(evicted_row)
+    
+    def _remove_row(self, row: int):
+        """
+        Remove an embedding from the matrix by moving the last row in its place.
+        
+        Args:
+            row: The row to remove
+        """
+        last_row = len(self._row_keys) - 1
+        last_key = self._row_keys.pop()
+        if row != last_row:
+            self._matrix[row] = self._matrix[last_row]
+            self._row_keys[row] = last_key
+            # Assigning an existing key keeps its position in the LRU order
+            self._entries[last_key] = (row, self._entries[last_key][1])
@@ -0,0 +1,63 @@
+"""
+Tests for the agent workflow, without any LLM or browser.
+"""
+
+import asyncio
+
+import orjson
+import pytest
+
+from src.email_monitor import EmailData
+from src.workflows.agent_workflow import (
+    TASK_TEMPLATES,
+    AgentWorkflow,
+    _concat_actions,
+    _signature,
+    _template_details,
+    dumps_state,
+)
+
+@pytest.mark.parametrize("task, signature, target", [
+    ("Summarize my inbox", "summarize_inbox", "inbox"),
+    ("please give me a summary of my gmail inbox.", "summarize_inbox", "inbox"),
+    ("Archive the emails from John Smith.", "archive", "John Smith"),
+    ("archive all messages from news@example.com", "archive", "news@example.com"),
+    ("Give me a summary of my LinkedIn inbox", None, None),
+    ("Archive the job posting on LinkedIn", None, None),
+    ("Archive emails from John and reply to Mary", None, None),
+])
+def test_task_templates(task, signature, target):
+    assert _signature(task) == signature
+    if signature is not None:
+        assert _template_details(signature, task)["target"] == target
+
+def test_template_details_are_copied():
+    details = _template_details("summarize_inbox", "summarize my inbox")
+    details["target"] = "changed"
+    assert TASK_TEMPLATES["summarize_inbox"][1]["target"] == "inbox"
+
+def test_concat_actions_accepts_lists():
+    assert _concat_actions([], ("a",)) == ("a",)
+    assert _concat_actions(("a",), ["b"]) == ("a", "b")
+
+def test_run_with_list_action_log():
+    state = asyncio.run(AgentWorkflow().run({"email_data": {}, "task": "x", "action_log": []}))
+    
+    assert state.get("error") is None
+    assert state["action_log"] == ("Opened browser", "Performed action", "Completed task")
+    assert state["results"]["success"]
+
+def test_run_keeps_existing_task_details():
+    state = asyncio.run(AgentWorkflow().run({"email_data": {}, "task": "x", "task_details": {"kept": True}}))
+    assert state["task_details"] == {"kept": True}
+
+def test_dumps_state_with_email_payload():
+    raw = b"Subject: s\r\n\r\nhello"
+    payload = EmailData(message_id="<id>", in_reply_to="", references="",
+                        subject="s", sender="a", raw_email_bytes=raw)
+    
+    dumped = orjson.loads(dumps_state({"email_data": payload, "task": "x", "action_log": ("a",)}))
+    
+    assert dumped["email_data"]["body"] == "hello"
+    assert dumped["email_data"]["raw_email_bytes"] == "U3ViamVjdDogcw0KDQpoZWxsbw=="
+    assert dumped["action_log"] == ["a"]
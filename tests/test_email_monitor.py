@@ -0,0 +1,189 @@
+"""
+Tests for the email monitoring component, with the IMAP client stubbed out.
+"""
+
+import asyncio
+import email
+from email import policy
+from types import SimpleNamespace
+
+import pytest
+
+from src import email_monitor
+from src.email_monitor import (
+    EmailData,
+    EmailMonitor,
+    _decode_header_value,
+    _extract_email_body,
+    _html_to_text,
+    _parse_fetch_response,
+)
+
+def _raw_email(subject: str, body: str = "hello") -> bytes:
+    return (
+        f"Subject: {subject}\r\n"
+        "From: Alice <alice@example.com>\r\n"
+        "Message-ID: <id@example.com>\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        "\r\n"
+        f"{body}\r\n"
+    ).encode()
+
+def _fetch_lines(messages):
+    lines = []
+    for seq, (uid, raw) in enumerate(messages, start=1):
+        lines.append(f"{seq} FETCH (UID {uid} BODY[] {{{len(raw)}}}".encode())
+        lines.append(bytearray(raw))
+        lines.append(b")")
+    lines.append(b"Success")
+    return lines
+
+class StubIMAP:
+    """Answers the UID commands of _process_new_emails from a fixed mailbox."""
+    
+    def __init__(self, messages):
+        self.messages = dict(messages)
+        self.stored = []
+    
+    async def uid(self, command, *args):
+        if command == 'search':
+            uids = ' '.join(str(uid) for uid in sorted(self.messages))
+            return SimpleNamespace(result='OK', lines=[uids.encode()])
+        if command == 'fetch':
+            uids = [int(uid) for uid in args[0].split(',')]
+            return SimpleNamespace(result='OK', lines=_fetch_lines((uid, self.messages[uid]) for uid in uids))
+        if command == 'store':
+            self.stored.append(args[0])
+            return SimpleNamespace(result='OK', lines=[])
+        raise AssertionError(f"Unexpected command {command}")
+
+@pytest.fixture
+def monitor(tmp_path, monkeypatch):
+    monkeypatch.setattr(email_monitor, 'LAST_UID_PATH', tmp_path / 'last_uid')
+    monitor = EmailMonitor('agent@example.com', 'password')
+    monitor._uid_validity = 1
+    monitor._last_uid = 10
+    return monitor
+
+def _process(monitor, imap):
+    received = []
+    
+    async def callback(payload):
+        received.append(payload)
+    
+    async def run():
+        monitor._imap = imap
+        found = await monitor._process_new_emails(callback)
+        await asyncio.gather(*monitor._tasks)
+        return found
+    
+    return asyncio.run(run()), received
+
+def test_unknown_header_charset_is_decoded_as_utf8():
+    assert _decode_header_value("=?x-bogus?q?hi?=") == "hi"
+
+def test_batch_with_undecodable_subject_is_delivered(monitor):
+    imap = StubIMAP({
+        11: _raw_email("first"),
+        12: _raw_email("=?x-bogus?q?caf=C3=A9?="),
+        13: _raw_email("third"),
+    })
+    
+    found, received = _process(monitor, imap)
+    
+    assert found
+    assert [payload["subject"] for payload in received] == ["first", "café", "third"]
+    assert imap.stored == ["11,12,13"]
+    assert monitor._last_uid == 13
+    assert email_monitor.LAST_UID_PATH.read_text() == "1 13"
+
+def test_unreadable_email_is_not_marked_handled(monitor, monkeypatch):
+    read_email = EmailMonitor._email_data
+    
+    def email_data(raw_email_bytes):
+        if b"broken" in raw_email_bytes:
+            raise ValueError("broken email")
+        return read_email(raw_email_bytes)
+    
+    monkeypatch.setattr(EmailMonitor, '_email_data', staticmethod(email_data))
+    imap = StubIMAP({11: _raw_email("first"), 12: _raw_email("second"), 13: _raw_email("broken")})
+    
+    found, received = _process(monitor, imap)
+    
+    assert found
+    assert [payload["subject"] for payload in received] == ["first", "second"]
+    assert imap.stored == ["11,12"]
+    assert monitor._last_uid == 12
+    
+    # The unreadable email is retried, without looping on it
+    found, received = _process(monitor, imap)
+    assert not found
+    assert received == []
+    assert monitor._last_uid == 12
+
+def test_search_ignores_already_handled_newest_email(monitor):
+    # "UID n:*" matches the newest email even when its UID is below n
+    imap = StubIMAP({10: _raw_email("old")})
+    
+    found, received = _process(monitor, imap)
+    
+    assert not found
+    assert received == []
+    assert imap.stored == []
+
+def test_parse_fetch_response_uid_after_literal():
+    lines = [b'1 FETCH (UID 7 BODY[] {5}', bytearray(b'abcde'), b')',
+             b'2 FETCH (BODY[] {3}', bytearray(b'xyz'), b' UID 9)', b'Success']
+    assert _parse_fetch_response(lines) == {'7': b'abcde', '9': b'xyz'}
+
+def _message(raw: bytes):
+    return email.message_from_bytes(raw, policy=policy.default)
+
+def test_body_without_charset_is_decoded_as_utf8():
+    raw = "Content-Type: text/plain\r\n\r\ncafé".encode()
+    assert _extract_email_body(_message(raw)) == "café"
+
+def test_body_with_declared_charset():
+    raw = (b"Content-Type: text/plain; charset=iso-8859-1\r\n"
+           b"Content-Transfer-Encoding: quoted-printable\r\n\r\ncaf=E9")
+    assert _extract_email_body(_message(raw)) == "café"
+
+def test_html_body_is_converted_when_there_is_no_plain_text():
+    raw = b"Content-Type: text/html; charset=utf-8\r\n\r\n<p>Hi <b>there</b></p><p>Bye</p>"
+    assert _extract_email_body(_message(raw)) == "Hi there\nBye"
+
+@pytest.mark.parametrize("use_selectolax", [True, False])
+def test_html_to_text_keeps_inline_elements_on_their_line(monkeypatch, use_selectolax):
+    if not use_selectolax:
+        monkeypatch.setattr(email_monitor, 'HTMLParser', None)
+    elif email_monitor.HTMLParser is None:
+        pytest.skip("selectolax is not installed")
+    
+    html = ("<html><head><title>T</title><style>p {}</style></head><body>"
+            "<p>World <b>bold</b>\n tail</p><div>x<br>y</div><script>z()</script></body></html>")
+    assert _html_to_text(html) == "World bold tail\nx\ny"
+
+def test_email_data_reads_body_lazily():
+    payload = EmailData(message_id="<id>", in_reply_to="", references="",
+                        subject="s", sender="a", raw_email_bytes=_raw_email("s"))
+    
+    assert "body" in payload
+    assert payload._body_pending
+    
+    copy = payload.copy()
+    copy["extra"] = 1
+    assert "extra" not in payload
+    assert copy._body_pending
+    
+    assert dict(payload)["body"] == "hello\r\n"
+    assert not payload._body_pending
+    assert payload.raw_email()["From"] == "Alice <alice@example.com>"
+
+def test_stop_monitoring_is_synchronous(monitor):
+    async def run():
+        monitor.is_running = True
+        assert monitor.stop_monitoring() is None
+        return monitor._stopped.is_set()
+    
+    assert asyncio.run(run())
+    assert not monitor.is_running
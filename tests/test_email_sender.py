@@ -0,0 +1,24 @@
+"""
+Tests for the subject threading helpers of the email sender.
+"""
+
+import pytest
+
+from src.email_sender import _ensure_re, _thread_subject
+
+@pytest.mark.parametrize("subject, expected", [
+    ("Hello", "Re: Hello"),
+    ("Re: Hello", "Re: Hello"),
+    ("RE : Hello", "RE : Hello"),
+    ("AW: Hallo", "AW: Hallo"),
+    ("Regarding the trip", "Re: Regarding the trip"),
+])
+def test_ensure_re(subject, expected):
+    assert _ensure_re(subject) == expected
+
+def test_thread_subject_of_reply():
+    assert _thread_subject("Hello", "<id@example.com>", "Completed") == "Re: Hello"
+
+def test_thread_subject_of_new_thread():
+    assert _thread_subject("Hello", None, "Completed") == "Completed: Hello"
+    assert _thread_subject("completed: Hello", None, "Completed") == "completed: Hello"
@@ -0,0 +1,78 @@
+"""
+Tests for the semantic cache of task interpretations.
+"""
+
+import asyncio
+
+import numpy as np
+
+from src.workflows.semantic_cache import SemanticCache
+
+# Orthogonal embeddings, except that paraphrases share their task's
+EMBEDDINGS = {
+    "a": [1, 0, 0, 0],
+    "b": [0, 1, 0, 0],
+    "c": [0, 0, 1, 0],
+    "d": [0, 0, 0, 1],
+    "paraphrase of b": [0, 2, 0, 0],
+}
+
+async def _embed(text):
+    return EMBEDDINGS[text]
+
+def _fill(cache, tasks, **kwargs):
+    async def fill():
+        for task in tasks:
+            _, embedding = await cache.lookup(task)
+            await cache.update(task, {"task": task}, embedding, **kwargs)
+    asyncio.run(fill())
+
+def _lookup(cache, task):
+    return asyncio.run(cache.lookup(task))[0]
+
+def _check_rows(cache):
+    # Every row belongs to the entry pointing at it, and holds its embedding
+    assert len(cache._row_keys) == sum(row is not None for row, _ in cache._entries.values())
+    for key, (row, value) in cache._entries.items():
+        if row is not None:
+            assert cache._row_keys[row] == key
+            expected = np.asarray(EMBEDDINGS[value["task"]], dtype=np.float32)
+            np.testing.assert_allclose(cache._matrix[row], expected / np.linalg.norm(expected))
+
+def test_exact_and_semantic_hits():
+    cache = SemanticCache(embed=_embed)
+    _fill(cache, ["a", "b"])
+    
+    assert _lookup(cache, "a") == {"task": "a"}
+    assert _lookup(cache, "paraphrase of b") == {"task": "b"}
+    assert _lookup(cache, "c") is None
+
+def test_eviction_moves_the_last_row():
+    cache = SemanticCache(embed=_embed, max_entries=3)
+    _fill(cache, ["a", "b", "c"])
+    
+    # "a" is the least recently used, its row is reused by "c"'s
+    _fill(cache, ["d"])
+    
+    assert _lookup(cache, "a") is None
+    assert len(cache._row_keys) == 3
+    _check_rows(cache)
+    assert _lookup(cache, "paraphrase of b") == {"task": "b"}
+
+def test_task_specific_values_only_hit_exactly():
+    cache = SemanticCache(embed=_embed)
+    _fill(cache, ["b"], semantic=False)
+    
+    assert _lookup(cache, "b") == {"task": "b"}
+    assert _lookup(cache, "paraphrase of b") is None
+    assert cache._row_keys == []
+
+def test_values_are_copied():
+    cache = SemanticCache(embed=_embed)
+    _fill(cache, ["a"])
+    
+    _lookup(cache, "a")["task"] = "changed"
+    assert _lookup(cache, "a") == {"task": "a"}
+
+def test_namespace_is_part_of_the_key():
+    assert SemanticCache(namespace="m1")._key("a") != SemanticCache(namespace="m2")._key("a")